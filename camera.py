@@ -1,46 +1,195 @@
-from dataclasses import dataclass, field
+from typing import Optional
 
+import numpy as np
 import pygame
 from pygame import Rect, Vector2
 
+from rectf import Rectf
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
 
 def get_screen_size() -> Vector2:
     return Vector2(pygame.display.get_surface().get_size())
 
 
-@dataclass
 class Camera:
-    position: Vector2 = field(default_factory=Vector2)
-    screen_size: Vector2 = field(default_factory=get_screen_size)
-    width: float = 10
+    # The transforms between world and pixel coordinates are
+    # just a scale and an offset. They are cached in _sx, _sy,
+    # _ox and _oy and recomputed when the camera is changed.
+    # The same goes for the size and view rect of the camera.
+    __slots__ = ('_position', '_screen_size', '_width',
+                 '_sx', '_sy', '_ox', '_oy', '_scale', '_offset',
+                 '_height', '_size', '_view_rect', '_view_left',
+                 '_view_right', '_view_bottom', '_view_top', '_dirty')
+
+    def __init__(
+            self, position: Optional[Vector2] = None,
+            screen_size: Optional[Vector2] = None, width: float = 10):
+        self.position = position if position is not None else Vector2()
+        self.screen_size = screen_size if screen_size is not None \
+            else get_screen_size()
+        self.width = width
+
+    @property
+    def position(self) -> Vector2:
+        return self._position
+
+    @position.setter
+    def position(self, position: Vector2):
+        self._position = position
+        self._dirty = True
+
+    def move_to(self, x: float, y: float):
+        """
+        Moves the camera by updating its position vector in place.
+        """
+        self._position.update(x, y)
+        self._dirty = True
+
+    @property
+    def screen_size(self) -> Vector2:
+        return self._screen_size
+
+    @screen_size.setter
+    def screen_size(self, screen_size: Vector2):
+        self._screen_size = screen_size
+        self._dirty = True
+
+    def resize(self, width: float, height: float):
+        """
+        Resizes the screen by updating its size vector in place.
+        """
+        self._screen_size.update(width, height)
+        self._dirty = True
+
+    @property
+    def width(self) -> float:
+        return self._width
+
+    @width.setter
+    def width(self, width: float):
+        self._width = width
+        self._dirty = True
 
     @property
     def height(self) -> float:
-        return self.width * self.screen_size.y / self.screen_size.x
+        if self._dirty:
+            self._recompute()
+
+        return self._height
 
     @property
     def size(self) -> Vector2:
-        return Vector2(self.width, self.height)
+        if self._dirty:
+            self._recompute()
+
+        return self._size
 
     @property
     def view_rect(self) -> Rect:
-        return Rect(self.position - self.size / 2, self.size / 2)
+        if self._dirty:
+            self._recompute()
+
+        return self._view_rect
+
+    def inside(self, rect: Rectf) -> bool:
+        if self._dirty:
+            self._recompute()
 
-    def inside(self, rect: Rect) -> bool:
-        return self.view_rect.contains(rect)
+        return rect.left >= self._view_left and rect.right <= self._view_right \
+            and rect.bottom >= self._view_bottom and rect.top <= self._view_top
 
     def pixel_to_world(self, pos: Vector2) -> Vector2:
-        x = pos.x / self.screen_size.x * self.width - self.width / 2 + self.position.x
-        y = pos.y / self.screen_size.y * self.height - self.height / 2 + self.position.y
-        return Vector2(x, y)
+        if self._dirty:
+            self._recompute()
+
+        return Vector2((pos.x - self._ox) / self._sx,
+                       (pos.y - self._oy) / self._sy)
 
     def world_to_pixel(self, pos: Vector2) -> Vector2:
-        return (pos - self.position + self.size / 2) * self.world_to_pixel_ratio
+        if self._dirty:
+            self._recompute()
+
+        return Vector2(pos.x * self._sx + self._ox,
+                       pos.y * self._sy + self._oy)
+
+    def pixel_to_world_xy(self, x: float, y: float) -> tuple[float, float]:
+        if self._dirty:
+            self._recompute()
+
+        return (x - self._ox) / self._sx, (y - self._oy) / self._sy
+
+    def world_to_pixel_xy(self, x: float, y: float) -> tuple[float, float]:
+        if self._dirty:
+            self._recompute()
+
+        return x * self._sx + self._ox, y * self._sy + self._oy
+
+    def world_to_pixel_batch(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Transforms an (N, 2) array of world positions to pixel positions.
+        """
+        if self._dirty:
+            self._recompute()
+
+        if numba:
+            return world_to_pixel_loop(positions, self._sx, self._sy,
+                                       self._ox, self._oy)
+
+        return positions * self._scale + self._offset
 
     @property
     def pixel_to_world_ratio(self) -> float:
-        return self.width / self.screen_size.x
+        if self._dirty:
+            self._recompute()
+
+        return 1 / self._sx
 
     @property
     def world_to_pixel_ratio(self) -> float:
-        return self.screen_size.x / self.width
+        if self._dirty:
+            self._recompute()
+
+        return self._sx
+
+    def _recompute(self):
+        self._dirty = False
+
+        self._height = self._width * self._screen_size.y / self._screen_size.x
+        self._size = Vector2(self._width, self._height)
+        self._view_rect = Rect(self._position - self._size / 2, self._size / 2)
+
+        # The edges of the view in world coordinates. Bottom and top
+        # are the smallest and largest y like in Rectf.
+        self._view_left = self._position.x - self._width / 2
+        self._view_right = self._position.x + self._width / 2
+        self._view_bottom = self._position.y - self._height / 2
+        self._view_top = self._position.y + self._height / 2
+
+        self._sx = self._screen_size.x / self._width
+        self._sy = self._screen_size.y / self._height
+        self._ox = self._screen_size.x * 0.5 - self._position.x * self._sx
+        self._oy = self._screen_size.y * 0.5 - self._position.y * self._sy
+
+        self._scale = np.array([self._sx, self._sy])
+        self._offset = np.array([self._ox, self._oy])
+
+
+# The transform of world_to_pixel_batch written as a loop,
+# so numba compiles it to a single pass over the positions.
+def world_to_pixel_loop(positions, sx, sy, ox, oy):
+    pixels = np.empty(positions.shape)
+    for i in range(positions.shape[0]):
+        pixels[i, 0] = positions[i, 0] * sx + ox
+        pixels[i, 1] = positions[i, 1] * sy + oy
+
+    return pixels
+
+
+if numba:
+    world_to_pixel_loop = numba.njit(world_to_pixel_loop,
+                                     fastmath=True, cache=True)
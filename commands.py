@@ -1,31 +1,48 @@
 import inspect
+import logging
 
 from collections import namedtuple
 
 from pygame import Vector2
 
 from id import Id
-from player import Player
 from scope import Scope
 
 
 class Command:
     def __init__(self, function, only_most_recent):
+        self.function = function
+        self.only_most_recent = only_most_recent
+
+        # The signature is only inspected once when the command is
+        # created. Binding a command then just keeps the tuple of
+        # arguments. The namedtuple is only used to show them.
         parameters = inspect.signature(function).parameters
-        non_scope_parameters = list(parameters)[1:]
-        self._namedtuple = namedtuple(function.__name__, non_scope_parameters)
-        print(self._namedtuple)
+        self._parameter_names = tuple(parameters)[1:]
+        self._namedtuple = namedtuple(function.__name__, self._parameter_names)
+
+        logging.debug('Registered command %s%s',
+                      function.__name__, self._parameter_names)
 
     def bind(self, *args):
-        pass
+        if len(args) != len(self._parameter_names):
+            raise TypeError(f'{self.function.__name__} takes '
+                            f'{len(self._parameter_names)} arguments '
+                            f'but {len(args)} were given')
+
+        return BoundCommand(self, args)
 
 
 class BoundCommand:
-    def __init__(self, args, kwargs):
-        pass
+    def __init__(self, command, args):
+        self.command = command
+        self.args = args
 
     def __call__(self, scope: Scope):
-        pass
+        self.command.function(scope, *self.args)
+
+    def __repr__(self):
+        return repr(self.command._namedtuple._make(self.args))
 
 
 def command(function=None, *, only_most_recent=False):
@@ -55,14 +72,17 @@ def set_name(scope: Scope, id_: Id, name: str):
 
 @command
 def remove_player(scope: Scope, id_: Id):
-    del scope.players[id_]
+    scope.remove_player(id_)
 
 
 @command(only_most_recent=True)
 def set_player_position(
         scope: Scope, id_: Id, position: Vector2,
         last_acceleration: Vector2, velocity: Vector2):
-    player = scope.players.setdefault(id_, Player(id_))
+    player = scope.players.get(id_)
+    if player is None:
+        player = scope.add_player(id_)
+
     player.position = position
     player.last_acceleration = last_acceleration
     player.velocity = velocity
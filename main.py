@@ -1,8 +1,12 @@
 import abc
 import atexit
 import logging
-import random
+import math
+import multiprocessing
 
+from itertools import groupby
+
+import numpy as np
 import pygame
 from pygame import Color, Vector2
 
@@ -15,26 +19,59 @@ from scope import Scope
 # Pygame skal helst initialiseres så hurtigt så muligt
 # Hvis vi begynder at importere klasser, som f.eks. bruger en skrifttype
 # som standard parameter, så klager pygame.
-pygame.init()
+# Only the modules that are used are initialized. pygame.init would
+# also start the joystick module, which SDL then polls for events.
+# The mixer is started by the menu when the music is loaded.
+pygame.display.init()
+pygame.font.init()
+
+font = ui.sys_font('MS UI Gothic', 24)
+mainMenuFont = ui.sys_font('MS UI Gothic', 48)
+
+
+SCREEN_SIZE = (800, 600)
 
-font = pygame.font.SysFont('MS UI Gothic', 24)
-mainMenuFont = pygame.font.SysFont('MS UI Gothic', 48)
+# The game is paced by vsync when it is available, FRAMERATE is just
+# a cap. The menus are static so they don't have to be drawn as often.
+FRAMERATE = 120
+MENU_FRAMERATE = 30
+
+# How many seconds a hosted server has to start listening
+SERVER_START_TIMEOUT = 5
+MAX_PACKETS = 64
+BUSH_CACHE_SIZE = 32
+MENU_MUSIC_PATH = 'BattleBalls.wav'
+WHITE = pygame.Color('white')
+
+# The event types the scenes and widgets handle
+HANDLED_EVENTS = [pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP,
+                  pygame.VIDEORESIZE, pygame.MOUSEBUTTONUP,
+                  pygame.TEXTINPUT]
 
 
 class QuitException(Exception):
     pass
 
 
+def ignore_event(event):
+    pass
+
+
 # NOTE: "yield from" can be used to give control to another Scene.
 # Returning from start returns control to the previous scene
 # and QuitException unwinds the entire stack and quits the game.
+# A scene yields the list of rects it drew this frame, or None
+# if the whole screen has to be updated.
 class Scene(abc.ABC):
+    def __init__(self):
+        self._generator = None
+
     @abc.abstractmethod
     def start(self):
         pass
 
     def send(self, events):
-        if not hasattr(self, '_generator'):
+        if self._generator is None:
             self._generator = self.start()
             # Make the generator run until the first yield
             self._generator.send(None)
@@ -50,105 +87,195 @@ class Scene(abc.ABC):
 
 class UiScene(Scene):
     def __init__(self, screen, widgets: list[ui.Widget]):
+        super().__init__()
         self.screen = screen
         self.widgets = widgets
+        self.clock = pygame.time.Clock()
 
     def start(self):
+        # The rects drawn this frame are yielded to the main loop
+        # so only those parts of the screen have to be updated.
+        rects = None
         while True:
-            events = yield
+            self.clock.tick(MENU_FRAMERATE)
+            events = yield rects
             for event in events:
                 for widget in self.widgets:
                     widget.handle(event)
 
-            for widget in self.widgets:
-                widget.draw(self.screen)
+            rects = [widget.draw(self.screen) for widget in self.widgets]
 
 
 class MainScene(Scene):
     def __init__(self, screen, client):
+        super().__init__()
         self.screen = screen
         self.client = client
 
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+
         self.clock = pygame.time.Clock()
         self.camera = Camera()
         self.scope = Scope()
 
-        self.unscaled_bush = pygame.image.load('bush.png').convert_alpha()
+        # The bush is converted to the format of the screen so
+        # blitting it is a direct copy. Scaling keeps the format.
+        self.unscaled_bush = pygame.image.load('bush.png') \
+            .convert_alpha(screen)
+        self.bush_size = None
+        self.scaled_bushes = {}
         self.scale_bush()
-        self.bushes = [Vector2(random.uniform(-20, 20),
-                               random.uniform(-20, 20))
-                       for _ in range(100)]
 
-    def scale_bush(self):
-        self.bush = pygame.transform.smoothscale(
-            self.unscaled_bush,
-            Vector2(1, 1) * self.camera.world_to_pixel_ratio)
+        self.bushes = np.random.uniform(-20, 20, (100, 2)).astype(np.float32)
+        # The center of a bush is half a unit from its position
+        self.bush_centers = self.bushes + 0.5
 
-    def start(self):
-        pygame.mixer.music.stop()
+        # Maps an event type to the method that handles it
+        self.event_handlers = {
+            pygame.KEYDOWN: self.handle_key_down,
+            pygame.KEYUP: self.handle_key_up,
+            pygame.VIDEORESIZE: self.handle_resize,
+        }
 
+    def scale_bush(self):
+        # A bush is one unit wide so its size in pixels is the ratio.
+        # It is only rescaled when that changes by a whole pixel.
+        size = int(self.camera.world_to_pixel_ratio)
+        if size == self.bush_size:
+            return
+
+        self.bush_size = size
+
+        # The camera zooms in and out with the speed of the player,
+        # so the sizes it has been at before are kept around. A size
+        # that is used again is moved to the end of the dict, so the
+        # first one is the least recently used and is dropped.
+        bush = self.scaled_bushes.pop(size, None)
+        if bush is None:
+            bush = pygame.transform.smoothscale(
+                self.unscaled_bush, (size, size))
+
+        self.scaled_bushes[size] = bush
+        if len(self.scaled_bushes) > BUSH_CACHE_SIZE:
+            del self.scaled_bushes[next(iter(self.scaled_bushes))]
+
+        self.bush = bush
+
+    def handle_key_down(self, event):
+        self.client.send(network.KeyDownInput(event.key))
+
+    def handle_key_up(self, event):
+        self.client.send(network.KeyUpInput(event.key))
+
+    def handle_resize(self, event):
+        # Resize the camera if the screen resizes. With SCALED the
+        # window is scaled but the screen keeps its size, so the
+        # camera goes by the size of the screen, not the window.
+        self.camera.resize(*self.screen.get_size())
+
+    # MainScene is run every frame of the game, so it is a plain method
+    # that MainMenuScene calls directly instead of a generator. start
+    # is kept so it can still be sent events like any other scene.
+    def start(self):
         while True:
-            # Control the framerate
-            deltatime = self.clock.tick(120) / 1000
-
-            # Yield control to the main loop and get the events
+            # The camera moves every frame so the whole
+            # screen is redrawn and nothing is yielded.
             events = yield
-
-            # Handle events
-            for event in events:
-                if event.type == pygame.KEYDOWN:
-                    self.client.send(network.KeyDownInput(event.key))
-                elif event.type == pygame.KEYUP:
-                    self.client.send(network.KeyUpInput(event.key))
-
-                # Resize the camera if the window resizes
-                elif event.type == pygame.VIDEORESIZE:
-                    self.camera.screen_size = Vector2(event.size)
-
-            # Ping the server so it doesn't disconnect us
-            self.client.send(network.Ping())
-
-            # Receive incoming packets
-            while cmd := self.client.recive():
-                cmd.run(self.scope)
-
-            # Camera follows the player
-            player = self.scope.players.get(self.scope.id_)
-
-            if player:
-                self.camera.width = 16 + player.velocity.length()
-                self.scale_bush()
-                self.camera.position += \
-                    2 * deltatime * (player.position - self.camera.position)
-            else:
-                self.camera.width = self.scope.circle_radius * 3
-                self.scale_bush()
-                self.camera.position = Vector2(0)
-
-            # Draw the playing field
-            pygame.draw.circle(self.screen, Color(0),
-                               self.camera.world_to_pixel(Vector2(0)),
-                               self.scope.circle_radius
-                               * self.camera.world_to_pixel_ratio,
-                               10)
-
-            # Draw the bushes
-            for bush in self.bushes:
-                if (bush + Vector2(0.5)).length() + 0.5 < self.scope.circle_radius:
-                    self.screen.blit(self.bush,
-                                     self.camera.world_to_pixel(bush))
-
-            # Draw the players
-            for player in self.scope.players.values():
-                player.draw(self)
+            self.update(events)
+
+    def update(self, events):
+        # The objects used more than once are bound to locals. Their
+        # attributes that change, like the arrays of the scope and the
+        # bush surface, are still looked up when they are used.
+        screen = self.screen
+        camera = self.camera
+        scope = self.scope
+        event_handlers = self.event_handlers
+        send = self.client.send
+        recive_many = self.client.recive_many
+
+        # Cap the framerate. The frames are normally paced by vsync
+        # when the screen is flipped, so the frame time is measured
+        # instead of busy waiting for a fixed one.
+        deltatime = self.clock.tick(FRAMERATE) / 1000
+
+        # Handle events
+        for event in events:
+            event_handlers.get(event.type, ignore_event)(event)
+
+        # Ping the server so it doesn't disconnect us
+        send(network.Ping())
+
+        # Receive incoming packets. At most MAX_PACKETS are handled
+        # per frame so a burst can't stall the game, the rest wait
+        # for the next frame. The commands are run in the order they
+        # arrived, with each run of the same type run as one batch.
+        for type_, cmds in groupby(recive_many(MAX_PACKETS), type):
+            type_.run_batch(scope, cmds)
+
+        # The server only sends a position when it differs from where
+        # the player would be with its last velocity, so the players
+        # are moved by their velocity in between.
+        scope.extrapolate(deltatime)
+
+        circle_radius = scope.circle_radius
+
+        # Camera follows the player
+        player = scope.players.get(scope.id_)
+
+        if player:
+            px, py = scope.positions[player.row].tolist()
+            vx, vy = scope.velocities[player.row].tolist()
+            camera.width = 16 + math.hypot(vx, vy)
+            self.scale_bush()
+
+            cx, cy = camera.position
+            k = 2 * deltatime
+            camera.move_to(cx + k * (px - cx), cy + k * (py - cy))
+        else:
+            camera.width = circle_radius * 3
+            self.scale_bush()
+            camera.move_to(0, 0)
+
+        # Draw the playing field
+        cx, cy = camera.world_to_pixel_xy(0, 0)
+        radius = circle_radius * camera.world_to_pixel_ratio
+        pygame.draw.circle(screen, Color(0), (cx, cy), radius, 10)
+
+        # Draw the bushes that are completely inside the playing field.
+        # The squared distances are compared to avoid the square root.
+        bushes = self.bushes
+        centers = self.bush_centers
+        distances_squared = np.einsum('ij,ij->i', centers, centers)
+        inside = distances_squared < (circle_radius - 0.5) ** 2
+        bush = self.bush
+        # The positions are made whole pixels at once so blits
+        # gets tuples of ints instead of converting every float.
+        bush_pixels = camera.world_to_pixel_batch(bushes[inside]) \
+            .astype(int)
+        screen.blits([(bush, pos) for pos in bush_pixels.tolist()],
+                     doreturn=False)
+
+        # Draw the players. Their rows in the position array
+        # are in the same order as the players in the scope.
+        pixel_positions = camera.world_to_pixel_batch(scope.positions)
+        for player, pixel_position in zip(scope.players.values(),
+                                          pixel_positions.tolist()):
+            player.draw(self, pixel_position)
 
 
 class MainMenuScene(Scene):
+    music_loaded = False
+
     def __init__(self, screen):
+        super().__init__()
         self.screen = screen
         self.should_host = None
 
         self.server = None
+        self.server_stop = None
+        self.server_status = None
         self.client = None
 
         atexit.register(self.close)
@@ -157,8 +284,15 @@ class MainMenuScene(Scene):
         self.should_host = should_host
 
     def start(self):
-        pygame.mixer.music.load('BattleBalls.wav')
-        pygame.mixer.music.set_volume(0.15)
+        # The music is only loaded the first time the menu is shown
+        if not MainMenuScene.music_loaded:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+
+            pygame.mixer.music.load(MENU_MUSIC_PATH)
+            pygame.mixer.music.set_volume(0.15)
+            MainMenuScene.music_loaded = True
+
         pygame.mixer.music.play(-1)
         title = ui.Text("Battle Balls", mainMenuFont, pos = Vector2(245, 100))
         host_button = ui.Button(pos=Vector2(240, 250),
@@ -170,12 +304,30 @@ class MainMenuScene(Scene):
 
         ui_scene = UiScene(self.screen, [title, host_button, client_button])
 
-        while self.should_host is None:
-            events = yield
-            ui_scene.send(events)
+        error_text = ui.Text('', font, pos=Vector2(10, 500),
+                             color=Color('red'))
+
+        while True:
+            rects = None
+            while self.should_host is None:
+                events = yield rects
+                rects = ui_scene.send(events)
+
+            if not self.should_host:
+                break
+
+            error = self.start_server()
+            if error is None:
+                break
+
+            # Back to the menu with the reason hosting failed
+            logging.error("Server failed to start: %s", error)
+            error_text.text = f'Could not host: {error}'
+            if error_text not in ui_scene.widgets:
+                ui_scene.widgets.append(error_text)
+            self.should_host = None
 
         if self.should_host:
-            self.server = network.GameServer('0.0.0.0')
             self.client = network.Client('127.0.0.1')
 
             host_address = ui.Text(
@@ -183,29 +335,82 @@ class MainMenuScene(Scene):
                 font, pos=Vector2(10, self.screen.get_height() - 40))
 
         else:
+            # The menu is replaced, so the whole screen is updated
+            yield None
             self.client = yield from ClientJoinScene(self.screen)
 
         main_scene = MainScene(self.screen, self.client)
+        server_stopped = False
 
         while True:
-            events = yield
-            main_scene.send(events)
+            events = yield None
+            main_scene.update(events)
 
             if self.server:
-                self.server.step()
+                # Tell the player if the server stopped, since the
+                # game would just stand still otherwise
+                if not server_stopped and not self.server.is_alive():
+                    server_stopped = True
+                    error = self.server_error()
+                    logging.error("Server stopped: %s", error)
+                    host_address.text = f'Server stopped: {error}'
+                    host_address.color = Color('red')
+
                 host_address.draw(self.screen)
 
+    def start_server(self):
+        """
+        Starts the server in its own process so it doesn't compete with
+        the game for the GIL. Returns why it failed to start, or None
+        once it is listening.
+        """
+        self.server_status, status = multiprocessing.Pipe(duplex=False)
+        self.server_stop = multiprocessing.Event()
+        self.server = multiprocessing.Process(
+            target=network.run_server,
+            args=('0.0.0.0', self.server_stop, status),
+            daemon=True)
+        self.server.start()
+        # Only the server process sends on the pipe
+        status.close()
+
+        if self.server_status.poll(SERVER_START_TIMEOUT):
+            error = self.server_error()
+        else:
+            error = 'the server did not start in time'
+
+        if error is not None:
+            self.stop_server()
+
+        return error
+
+    def server_error(self):
+        # The server sends None when it is listening and its error if
+        # it fails. If it died without sending anything the pipe is
+        # closed, and its exit code is all there is to go by.
+        try:
+            return self.server_status.recv()
+        except EOFError:
+            self.server.join(timeout=1)
+            return f'the server exited with code {self.server.exitcode}'
+
+    def stop_server(self):
+        self.server_stop.set()
+        self.server.join(timeout=1)
+        self.server = None
+
     def close(self):
         # Goodbye networking
         if self.client:
             self.client.close()
 
         if self.server:
-            self.server.close()
+            self.stop_server()
 
 
 class ClientJoinScene(Scene):
     def __init__(self, screen):
+        super().__init__()
         self.screen = screen
         self.address = None
 
@@ -225,6 +430,7 @@ class ClientJoinScene(Scene):
 
         ui_scene = UiScene(self.screen, [box, entry, join])
 
+        rects = None
         while True:
             if self.address is not None:
                 try:
@@ -236,8 +442,8 @@ class ClientJoinScene(Scene):
                     text.color = Color('red')
                     text.text = msg.format(' [invalid ip]')
 
-            events = yield
-            ui_scene.send(events)
+            events = yield rects
+            rects = ui_scene.send(events)
 
 
 def main():
@@ -245,12 +451,26 @@ def main():
     logging.basicConfig(level=logging.INFO)
 
     # Setup pygame
-    screen = pygame.display.set_mode((800, 600))
+    # Vsync binds the framerate to the display so no frames are drawn
+    # that are never shown. It needs a renderer, which SCALED gives,
+    # so fall back to a normal window if one can't be made.
+    try:
+        screen = pygame.display.set_mode(SCREEN_SIZE, pygame.SCALED, vsync=1)
+    except pygame.error:
+        screen = pygame.display.set_mode(SCREEN_SIZE)
     pygame.display.set_caption('Ball Bouncing')
 
+    # Only the events we handle are put on the event queue. The rest,
+    # especially the flood of mouse motion, is dropped by SDL.
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(HANDLED_EVENTS)
+
     # Create our main scene
     scene = MainMenuScene(screen)
 
+    # The rects drawn last frame, None means the whole screen
+    previous_rects = None
+
     # Main loop
     while True:
         try:
@@ -265,10 +485,28 @@ def main():
                         and event.key == pygame.K_ESCAPE:
                     raise QuitException()
 
+                # Everything has to be redrawn after a resize
+                if event.type == pygame.VIDEORESIZE:
+                    previous_rects = None
+
+            # Clear what was drawn last frame
+            if previous_rects is None:
+                screen.fill(WHITE)
+            else:
+                for rect in previous_rects:
+                    screen.fill(WHITE, rect)
+
             # Update and draw the scene
-            screen.fill(pygame.Color('white'))
-            scene.send(events)
-            pygame.display.flip()
+            rects = scene.send(events)
+
+            # Only update the parts of the screen that changed. That is
+            # what was cleared and what was drawn this frame.
+            if rects is None or previous_rects is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(previous_rects + rects)
+
+            previous_rects = rects
 
         except (QuitException, StopIteration):
             break
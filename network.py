@@ -1,18 +1,21 @@
 from __future__ import annotations
 
 import abc
+import heapq
 import logging
-import pickle
+import selectors
 import socket
+import struct
 import time
 
 from dataclasses import dataclass
 from itertools import count
 
+import numpy as np
 import pygame
 from pygame import Vector2
 
-from player import Player
+import udp
 from id import Id
 from scope import Scope
 
@@ -27,8 +30,68 @@ def get_local_ip():
 PROTOCOL_ID = 718420690
 PROTOCOL_HEADER = PROTOCOL_ID.to_bytes(4, byteorder='little')
 
+# A packet is only handled if it starts with the protocol id and has
+# something after it. The id is read as an int and compared to
+# PROTOCOL_ID instead of comparing a slice of the packet.
+unpack_header = struct.Struct('<I').unpack_from
+
 PORT = 39311
 
+# The tags of the inputs on the wire. The server handles these
+# straight from the packets, see GameServer.raw_handlers.
+KEY_UP_TAG = 10
+KEY_DOWN_TAG = 11
+PING_TAG = 12
+KEY = struct.Struct('<i')
+
+# The sizes of the socket buffers, so bursts of packets aren't dropped
+# by the kernel. Linux caps them at net.core.rmem_max and wmem_max
+# unless the process is allowed to force them, so those sysctls have
+# to be raised for buffers this big.
+RCVBUF = 4_000_000
+SNDBUF = 4_000_000
+
+# How many times per second run_server steps the server
+SERVER_TICKRATE = 120
+
+# The physics of the server is stepped with this fixed timestep
+PHYSICS_TIMESTEP = 1 / 120
+MAX_PHYSICS_STEPS = 5
+
+# A position is only sent when the player is further than this from
+# where the clients think it is, or when it hasn't been sent for
+# KEYFRAME_INTERVAL seconds. See GameServer.should_send_position.
+POSITION_TOLERANCE = 0.05
+KEYFRAME_INTERVAL = 1
+
+# Positions, velocities and accelerations are sent as 16 bit fixed
+# point numbers. They are the number of 1 / SCALE steps, so positions
+# are in centimeters and go up to about 327 meters from the center.
+POSITION_SCALE = 100
+VELOCITY_SCALE = 100
+ACCELERATION_SCALE = 1000
+
+
+def enlarge_buffers(sock: socket.socket):
+    for name, option, force, size in [
+            ('Receive', socket.SO_RCVBUF,
+             getattr(socket, 'SO_RCVBUFFORCE', None), RCVBUF),
+            ('Send', socket.SO_SNDBUF,
+             getattr(socket, 'SO_SNDBUFFORCE', None), SNDBUF)]:
+        # Forcing the size ignores the sysctl limits but needs root
+        if force is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, force, size)
+            except OSError:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, option, size)
+
+        # Linux reports double the size it was set to, and less than
+        # asked for if it was capped by the sysctls
+        logging.debug("%s buffer is %d bytes", name,
+                      sock.getsockopt(socket.SOL_SOCKET, option))
+
 
 class Client:
     def __init__(self, address: str, blocking: bool = False):
@@ -36,20 +99,66 @@ class Client:
 
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._socket.setblocking(blocking)
+        enlarge_buffers(self._socket)
+
+        # The client only talks to the server, so the socket is
+        # connected to it. The kernel then drops the packets from
+        # anywhere else and the address isn't passed on every send.
+        # A connected socket reports when nothing is listening on
+        # the server port, which is ignored like any lost packet.
+        self._socket.connect((self.host, PORT))
+
+        self._buffer = bytearray(4096)
+        self._view = memoryview(self._buffer)
+        self._receiver = udp.Receiver(self._socket)
+
+        # The acknowledgements of the types registered with
+        # register_struct are packed into this buffer and sent from it
+        self._send_buffer = bytearray(MAX_PACKET_SIZE)
+        self._send_view = memoryview(self._send_buffer)
 
     @property
     def address(self):
         return self._socket.getsockname()
 
     def recive(self):
+        # The packet is received into the same buffer every time
+        # and decoded straight from it, so it is never copied.
         try:
-            data, address = self._socket.recvfrom(4096)
-        except BlockingIOError:
+            size, address = self._socket.recvfrom_into(self._buffer)
+        except (BlockingIOError, ConnectionRefusedError):
             return None
 
-        if address[0] == self.host and data.startswith(PROTOCOL_HEADER):
-            data = data.removeprefix(PROTOCOL_HEADER)
-            obj = pickle.loads(data)
+        return self._handle_packet(self._view[:size], address)
+
+    def recive_many(self, limit: int) -> list:
+        # The packets are received in batches like on the server.
+        # The commands of a batch are returned as if they were
+        # received one by one, so they can still be run in batches
+        # by type. A batch only counts as one towards the limit.
+        objs = []
+        received = 0
+        while received < limit:
+            wanted = min(limit - received, udp.RECEIVE_BATCH_SIZE)
+            packets = self._receiver.receive(wanted)
+            received += len(packets)
+
+            for data, address in packets:
+                obj = self._handle_packet(data, address)
+                if isinstance(obj, BatchCommand):
+                    objs.extend(obj.commands)
+                elif obj is not None:
+                    objs.append(obj)
+
+            if len(packets) < wanted:
+                break
+
+        return objs
+
+    def _handle_packet(self, data, address: tuple[str, int]):
+        header_size = len(PROTOCOL_HEADER)
+        if len(data) > header_size and unpack_header(data)[0] == PROTOCOL_ID:
+            obj = decode(data, header_size)
 
             if isinstance(obj, Acknowledged):
                 self.send(Acknowledge(obj))
@@ -59,25 +168,68 @@ class Client:
         return None
 
     def send(self, obj):
-        # I could create a class that buffers the pickler and unpickler with BytesIO
-        data = PROTOCOL_HEADER + pickle.dumps(obj)
-        self._socket.sendto(data, (self.host, PORT))
+        # There are only a few different inputs, so their packets are
+        # made once and sent again every time the same input is sent
+        if isinstance(obj, Input):
+            data = _input_packets.get(obj)
+            if data is None:
+                data = _input_packets[obj] = packet(obj)
+        elif isinstance(obj, Acknowledge) \
+                and type(obj.obj) in _acknowledge_packers:
+            packer, tag, fields = _acknowledge_packers[type(obj.obj)]
+            packer.pack_into(self._send_buffer, 0, PROTOCOL_ID,
+                             ACKNOWLEDGE_TAG, tag, *fields(obj.obj))
+            data = self._send_view[:packer.size]
+        else:
+            data = packet(obj)
+
+        try:
+            self._socket.send(data)
+        except ConnectionRefusedError:
+            pass
 
     def close(self):
         self._socket.close()
 
 
 class Server(abc.ABC):
+    # Maps the tag of a packet to a method that handles it without
+    # decoding it to an object. It is called with the address, the
+    # data and the offset of the fields after the tag.
+    raw_handlers = {}
+
+    # Pings only keep a client from timing out. Servers that don't
+    # do anything else with them set this, so a packet that is a ping
+    # is found by comparing it to PING_PACKET and never dispatched.
+    ignore_pings = False
+
     def __init__(self, address: str, client_timeout: float = 2):
-        self.clients = []
+        # timeouts maps each client to when it was last active and
+        # clients is a live view of its keys, so a client is only
+        # stored and looked up in one dict.
         self.timeouts = {}
+        self.clients = self.timeouts.keys()
         self.client_timeout = client_timeout
 
+        # A heap of (deadline, address) of when each client might have
+        # timed out, so only the clients whose deadline has passed are
+        # checked. If they have been active since, they get a new one.
+        # deadlines maps a client to its deadline in the heap, so older
+        # entries of a client that reconnected are skipped.
+        self._deadline_heap = []
+        self._deadlines = {}
+        self._now = time.monotonic()
+
         self.not_acknoledged = set()
 
+        # The packets sent during a step are sent at once at its end
+        self._outgoing = []
+
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        enlarge_buffers(self._socket)
         self._socket.bind((address, PORT))
         self._socket.setblocking(False)
+        self._receiver = udp.Receiver(self._socket)
 
         logging.info("Server created on: %s", self.address)
 
@@ -87,7 +239,7 @@ class Server(abc.ABC):
 
     def update(self):
         for missing in self.not_acknoledged:
-            print(f"Resending unacknowledged message: {missing}")
+            logging.debug("Resending unacknowledged message: %s", missing)
             self.send_to(missing[0], missing[1], acknoledge=False)
 
     def handle_connect(self, address: tuple[str, int]):
@@ -105,47 +257,136 @@ class Server(abc.ABC):
         self._socket.close()
 
     def step(self):
+        # The time is only read once per step. It is monotonic so
+        # changing the clock of the computer doesn't time out clients.
+        self._now = time.monotonic()
+
         self._handle_messages()
         self._check_disconnects()
         self.update()
+        self._flush()
+
+    def serve(self, stop, tickrate: float):
+        """
+        Steps the server tickrate times per second until stop is set.
+        Between the steps it waits on the socket instead of sleeping,
+        so packets are handled as soon as they arrive.
+        """
+        interval = 1 / tickrate
+        selector = selectors.DefaultSelector()
+        selector.register(self._socket, selectors.EVENT_READ)
+        next_step = time.monotonic()
+
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                if now >= next_step:
+                    self.step()
+                    # A step that ran late doesn't make the next ones
+                    # run back to back to catch up
+                    next_step = max(next_step + interval, now)
+                elif selector.select(next_step - now):
+                    self._now = time.monotonic()
+                    self._handle_messages()
+        finally:
+            selector.close()
 
     def send_to(self, address: tuple[str, int], obj, acknoledge=True):
         if isinstance(obj, Acknowledged) and acknoledge:
             self.not_acknoledged.add((address, obj))
 
-        data = PROTOCOL_HEADER + pickle.dumps(obj)
-        self._socket.sendto(data, address)
+        self._outgoing.append((packet(obj), address))
 
     def send_to_all(self, obj):
+        # The object is only encoded once and the same packet is
+        # sent to every client. They still each acknowledge it.
+        data = packet(obj)
+
+        if isinstance(obj, Acknowledged):
+            for address in self.clients:
+                self.not_acknoledged.add((address, obj))
+
         for address in self.clients:
-            self.send_to(address, obj)
+            self._outgoing.append((data, address))
+
+    def send_batch_to_all(self, objs):
+        """
+        Sends the objects to every client in as few packets as possible.
+        The objects must not be Acknowledged.
+        """
+        for data in batch_packets(objs):
+            for address in self.clients:
+                self._outgoing.append((data, address))
+
+    def _flush(self):
+        udp.send_many(self._socket, self._outgoing)
+        self._outgoing.clear()
 
     def _handle_messages(self):
+        # This runs for every packet, so what it uses is bound to
+        # locals and the debug logging is only checked once.
+        receive = self._receiver.receive
+        header_size = len(PROTOCOL_HEADER)
+        timeouts = self.timeouts
+        now = self._now
+        ping = PING_PACKET if self.ignore_pings else None
+        handle_message = self._handle_message
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+        # The packets are received in batches until a batch isn't full,
+        # which means there were no more packets waiting.
         while True:
-            try:
-                data, address = self._socket.recvfrom(4096)
-            except ConnectionResetError:
-                continue
-            except BlockingIOError:
+            packets = receive()
+
+            for data, address in packets:
+                if debug:
+                    logging.debug("Server received %s from: %s",
+                                  bytes(data), address)
+
+                # The data is a view into the buffer of the receiver.
+                # It is decoded with the header still on it, so it is
+                # never copied.
+                if data == ping and address in timeouts:
+                    timeouts[address] = now
+                elif len(data) > header_size \
+                        and unpack_header(data)[0] == PROTOCOL_ID:
+                    if address in timeouts:
+                        handle_message(address, data)
+                    else:
+                        self._handle_connect(address, data)
+
+            if len(packets) < udp.RECEIVE_BATCH_SIZE:
                 return
 
-            logging.debug("Server received %s from: %s", data, address)
+    def _check_disconnects(self):
+        now = self._now
+        heap = self._deadline_heap
 
-            if data.startswith(PROTOCOL_HEADER):
-                data = data.removeprefix(PROTOCOL_HEADER)
-                if address in self.clients:
-                    self._handle_message(address, data)
-                else:
-                    self._handle_connect(address, data)
+        while heap and heap[0][0] < now:
+            deadline, address = heapq.heappop(heap)
+            if self._deadlines.get(address) != deadline:
+                continue
 
-    def _check_disconnects(self):
-        for address, last_active in list(self.timeouts.items()):
-            if time.time() - last_active > self.client_timeout:
+            last_active = self.timeouts[address]
+            if now - last_active > self.client_timeout:
                 self._handle_disconnect(address)
+            else:
+                self._schedule(address, last_active + self.client_timeout)
+
+    def _schedule(self, address: tuple[str, int], deadline: float):
+        self._deadlines[address] = deadline
+        heapq.heappush(self._deadline_heap, (deadline, address))
 
     def _handle_message(self, address: tuple[str, int], data):
-        self.timeouts[address] = time.time()
-        obj = pickle.loads(data)
+        self.timeouts[address] = self._now
+
+        offset = len(PROTOCOL_HEADER)
+        raw_handler = self.raw_handlers.get(data[offset])
+        if raw_handler is not None:
+            raw_handler(self, address, data, offset + 1)
+            return
+
+        obj = decode(data, offset)
 
         if isinstance(obj, Acknowledge):
             try:
@@ -157,15 +398,16 @@ class Server(abc.ABC):
 
     def _handle_connect(self, address: tuple[str, int], data):
         logging.debug("Server accepted client: %s", address)
-        self.clients.append(address)
+        self.timeouts[address] = self._now
         self.handle_connect(address)
 
+        self._schedule(address, self._now + self.client_timeout)
         self._handle_message(address, data)
 
     def _handle_disconnect(self, address: tuple[str, int]):
         logging.debug("Server lost client: %s", address)
-        self.clients.remove(address)
         del self.timeouts[address]
+        del self._deadlines[address]
         self.handle_disconnect(address)
 
 
@@ -185,43 +427,112 @@ class GameServer(Server):
         self.pressed_keys = {}
         self.scope = Scope()
 
+        # The position, velocity and time of the last
+        # position sent of each player
+        self.last_sent = {}
+
         self.clock = pygame.time.Clock()
+        # The time that has passed that the physics hasn't stepped
+        self._unsimulated = 0.0
 
     def update(self):
         super().update()
 
-        deltatime = self.clock.tick() / 1000
+        # The physics is stepped with a fixed timestep however long it
+        # has been since the last update, so it behaves the same no
+        # matter how regularly the server is stepped. A slow update
+        # only catches up on MAX_PHYSICS_STEPS steps.
+        self._unsimulated = min(
+            self._unsimulated + self.clock.tick() / 1000,
+            MAX_PHYSICS_STEPS * PHYSICS_TIMESTEP)
+        if self._unsimulated < PHYSICS_TIMESTEP:
+            return
+
+        radius = self.scope.circle_radius
+        while self._unsimulated >= PHYSICS_TIMESTEP:
+            self._unsimulated -= PHYSICS_TIMESTEP
+            self.physics_step(PHYSICS_TIMESTEP)
+
+        # The commands of this tick that don't have to be acknowledged.
+        # They are sent together at the end of the tick.
+        commands = []
+        if self.scope.circle_radius != radius:
+            commands.append(SetRadiusCommand(self.scope.circle_radius))
+
+        # The positions and velocities are sent as tuples of floats
+        positions = self.scope.positions.tolist()
+        velocities = self.scope.velocities.tolist()
+        for id_, row in self.scope.rows.items():
+            position = tuple(positions[row])
+            velocity = tuple(velocities[row])
+
+            # Send a command that sets their new position
+            if self.should_send_position(id_, position, velocity):
+                self.last_sent[id_] = (position, velocity, self._now)
+                commands.append(SetPositionCommand(
+                    id_, position,
+                    tuple(self.scope.players[id_].last_acceleration),
+                    velocity
+                ))
 
+        self.send_batch_to_all(commands)
+
+    def physics_step(self, deltatime: float):
         # Decrease the size of the circle
         if self.scope.circle_radius > 2:
             self.scope.circle_radius -= 0.4 * deltatime
-            self.send_to_all(SetRadiusCommand(self.scope.circle_radius))
-
-        # Update the players
-        for id_, player in list(self.scope.players.items()):
-            # Get the pressed keys of the related client
-            # and update their player based on the keypresses.
-            pressed_keys = self.pressed_keys[id_]
-            player.update(pressed_keys, deltatime)
-            player.collision(self.scope.players.values())
-
-            # Send a command that sets their new position
-            self.send_to_all(SetPositionCommand(
-                id_, player.position,
-                player.last_acceleration, player.velocity
-            ))
 
-            # If they're outside the playing field kill them
-            if player.position.length() > self.scope.circle_radius:
+        # Get the pressed keys of the related clients
+        # and apply their input to their players.
+        for id_, player in self.scope.players.items():
+            player.input(self.pressed_keys[id_])
+
+        # Update the physics of all the players at once
+        self.scope.step(deltatime)
+
+        # If they're outside the playing field kill them. Their
+        # position isn't sent since it would arrive after the
+        # removal and add them again. Who is outside is found for
+        # every player at once from the positions in the scope.
+        positions = self.scope.positions
+        outside = np.hypot(positions[:, 0], positions[:, 1]) \
+            > self.scope.circle_radius
+        if outside.any():
+            ids = list(self.scope.players)
+            for row in np.flatnonzero(outside):
+                id_ = ids[row]
                 self.send_to_all(RemovePlayerCommand(id_))
-                del self.scope.players[id_]
+                self.scope.remove_player(id_)
+                self.last_sent.pop(id_, None)
+
+        self.scope.collide()
+
+    def should_send_position(
+            self, id_: Id, position: tuple[float, float],
+            velocity: tuple[float, float]) -> bool:
+        # Dead reckoning. The clients move the players with the last
+        # velocity they got, so the position is only sent when that
+        # is too far off. It is still sent every KEYFRAME_INTERVAL
+        # so a lost packet doesn't leave a player off for long.
+        last = self.last_sent.get(id_)
+        if last is None:
+            return True
+
+        last_position, last_velocity, time = last
+        elapsed = self._now - time
+        if elapsed > KEYFRAME_INTERVAL:
+            return True
+
+        dx = position[0] - last_position[0] - last_velocity[0] * elapsed
+        dy = position[1] - last_position[1] - last_velocity[1] * elapsed
+        return dx * dx + dy * dy > POSITION_TOLERANCE ** 2
 
     def handle_connect(self, new_address: tuple[str, int]):
         self.address_to_id[new_address] = self.next_id
         self.next_id += 1
 
         id_ = self.id_of(new_address)
-        self.scope.players[id_] = Player(id_)
+        self.scope.add_player(id_)
         self.pressed_keys[id_] = set()
 
         # Give the new player his id
@@ -229,18 +540,43 @@ class GameServer(Server):
 
         # The new player will be added to the other players
         # when their position is sent. The same goes for
-        # adding the old players to the new player.
+        # adding the old players to the new player, so
+        # every position is sent again.
+        self.last_sent.clear()
 
     def handle_disconnect(self, address: tuple[str, int]):
         id_ = self.id_of(address)
         try:
-            del self.scope.players[id_]
+            self.scope.remove_player(id_)
             del self.pressed_keys[id_]
         except KeyError:
             pass
 
+        self.last_sent.pop(id_, None)
+
         self.send_to_all(RemovePlayerCommand(id_))
 
+    def handle_key_down(self, address: tuple[str, int], data, offset: int):
+        key, = KEY.unpack_from(data, offset)
+        self.pressed_keys[self.address_to_id[address]].add(key)
+
+    def handle_key_up(self, address: tuple[str, int], data, offset: int):
+        key, = KEY.unpack_from(data, offset)
+        self.pressed_keys[self.address_to_id[address]].discard(key)
+
+    def handle_ping(self, address: tuple[str, int], data, offset: int):
+        pass
+
+    ignore_pings = True
+
+    # The inputs are sent every time a key changes and pings every
+    # frame, so they are handled without making an object for them
+    raw_handlers = {
+        KEY_DOWN_TAG: handle_key_down,
+        KEY_UP_TAG: handle_key_up,
+        PING_TAG: handle_ping,
+    }
+
     def handle(self, address: tuple[str, int], obj):
         id_ = self.id_of(address)
 
@@ -260,6 +596,37 @@ class GameServer(Server):
         return self.address_to_id[address]
 
 
+def run_server(address: str, stop, status=None):
+    """
+    Creates a GameServer and steps it until stop is set. It is meant
+    to be the target of a process so the server doesn't compete with
+    the game for the GIL. stop is a multiprocessing.Event and status
+    the sending end of a multiprocessing.Pipe. None is sent on it once
+    the server is listening, or the error if it fails to start or
+    crashes later.
+    """
+    def report(error):
+        if status is not None:
+            status.send(f'{type(error).__name__}: {error}')
+
+    try:
+        server = GameServer(address)
+    except Exception as error:
+        report(error)
+        raise
+
+    if status is not None:
+        status.send(None)
+
+    try:
+        server.serve(stop, SERVER_TICKRATE)
+    except Exception as error:
+        report(error)
+        raise
+    finally:
+        server.close()
+
+
 @dataclass
 class Acknowledge:
     obj: Acknowledged
@@ -274,6 +641,15 @@ class Command(abc.ABC):
     def run(self, scope: Scope):
         pass
 
+    @classmethod
+    def run_batch(cls, scope: Scope, commands):
+        """
+        Runs a sequence of commands of this type in order.
+        Subclasses can override it to run the batch faster.
+        """
+        for command in commands:
+            command.run(scope)
+
 
 class OnlyMostRecentCommand(Command):
     def __init_subclass__(cls):
@@ -281,18 +657,20 @@ class OnlyMostRecentCommand(Command):
         cls._global_counter = count()
         cls._max_count = 0
 
-        old_run = cls.run
-
-        def new_run(self, scope: Scope):
-            if self._count >= cls._max_count:
-                cls._max_count = self._count
-                old_run(self, scope)
-
-        cls.run = new_run
-
     def __init__(self):
         object.__setattr__(self, '_count', next(type(self)._global_counter))
 
+    def run(self, scope: Scope):
+        # Only run the command if no newer one of its type has been run
+        cls = type(self)
+        if self._count >= cls._max_count:
+            cls._max_count = self._count
+            self.run_most_recent(scope)
+
+    @abc.abstractmethod
+    def run_most_recent(self, scope: Scope):
+        pass
+
 
 @dataclass(frozen=True)
 class SetRadiusCommand(OnlyMostRecentCommand):
@@ -301,7 +679,7 @@ class SetRadiusCommand(OnlyMostRecentCommand):
     def __post_init__(self):
         super().__init__()
 
-    def run(self, scope: Scope):
+    def run_most_recent(self, scope: Scope):
         scope.circle_radius = self.radius
 
 
@@ -318,25 +696,67 @@ class RemovePlayerCommand(Command, Acknowledged):
     id_: Id
 
     def run(self, scope: Scope):
-        del scope.players[self.id_]
+        scope.remove_player(self.id_)
 
 
 @dataclass(frozen=True)
 class SetPositionCommand(OnlyMostRecentCommand):
     id_: Id
-    position: Vector2
-    last_acceleration: Vector2
-    velocity: Vector2
+    position: tuple[float, float]
+    last_acceleration: tuple[float, float]
+    velocity: tuple[float, float]
 
     def __post_init__(self):
         super().__init__()
 
-    def run(self, scope: Scope):
-        player = scope.players.setdefault(self.id_, Player(self.id_))
+    def run_most_recent(self, scope: Scope):
+        player = scope.players.get(self.id_)
+        if player is None:
+            player = scope.add_player(self.id_)
+
         player.position = self.position
-        player.last_acceleration = self.last_acceleration
+        player.last_acceleration = Vector2(self.last_acceleration)
         player.velocity = self.velocity
 
+    @classmethod
+    def run_batch(cls, scope: Scope, commands):
+        """
+        Runs the commands like calling run on each of them would,
+        but sets all the positions and velocities at once.
+        """
+        # Only the last command of a player is kept, like it would be
+        # the one to stick if they were run one at a time. Setting the
+        # same row twice in one scatter has no defined order.
+        recent = {}
+        for command in commands:
+            if command._count >= cls._max_count:
+                cls._max_count = command._count
+                recent[command.id_] = command
+
+        if not recent:
+            return
+
+        recent = list(recent.values())
+        for command in recent:
+            player = scope.players.get(command.id_)
+            if player is None:
+                player = scope.add_player(command.id_)
+
+            player.last_acceleration = Vector2(command.last_acceleration)
+
+        scope.set_positions([command.id_ for command in recent],
+                            [command.position for command in recent],
+                            [command.velocity for command in recent])
+
+
+@dataclass(frozen=True)
+class BatchCommand(Command):
+    commands: tuple[Command, ...]
+
+    def run(self, scope: Scope):
+        for command in self.commands:
+            command.run(scope)
+
 
 class Input:
     pass
@@ -352,5 +772,220 @@ class KeyDownInput(Input):
     key: int
 
 
+@dataclass(frozen=True)
 class Ping(Input):
     pass
+
+
+# The wire format of the objects sent between clients and servers.
+# A packet is a byte that tells the type of the object followed by
+# its fields packed with struct. It is much smaller than a pickle
+# and only the registered types can be received.
+
+_encoders = {}
+_decoders = {}
+
+# The types registered with register_struct are packed straight into
+# the buffer of a batch. This maps them to a struct of the length,
+# tag and fields of their entry in a batch and their fields function.
+_batch_packers = {}
+
+# The same for the whole packet of an Acknowledge of them, which is
+# the header, the acknowledge tag and the acknowledged object
+_acknowledge_packers = {}
+
+
+def register(cls, tag: int, encode_fields, decode_fields, pack=None):
+    """
+    Registers how to send objects of type cls. encode_fields returns
+    the bytes of the fields of an object and decode_fields makes the
+    object from the data at an offset. pack returns the whole packet
+    with the header and tag, if it can be made faster than by
+    concatenating them.
+    """
+    tag_bytes = bytes([tag])
+    if pack is None:
+        header = PROTOCOL_HEADER + tag_bytes
+        pack = lambda obj: header + encode_fields(obj)
+
+    _encoders[cls] = (tag_bytes, encode_fields, pack)
+    _decoders[tag] = decode_fields
+
+
+def register_struct(cls, tag: int, format: str, fields, make):
+    # The header and the tag are packed together with the fields,
+    # so making a packet is a single call to pack.
+    packer = struct.Struct('<' + format)
+    packet = struct.Struct('<IB' + format)
+    _batch_packers[cls] = (struct.Struct('<HB' + format), tag, fields)
+    _acknowledge_packers[cls] = (struct.Struct('<IBB' + format), tag, fields)
+    register(cls, tag,
+             lambda obj: packer.pack(*fields(obj)),
+             lambda data, offset: make(*packer.unpack_from(data, offset)),
+             lambda obj: packet.pack(PROTOCOL_ID, tag, *fields(obj)))
+
+
+def encode(obj) -> bytes:
+    tag, encode_fields, _ = _encoders[type(obj)]
+    return tag + encode_fields(obj)
+
+
+def packet(obj) -> bytes:
+    """
+    Returns the packet that sends obj, that is the header and the
+    encoded object.
+    """
+    return _encoders[type(obj)][2](obj)
+
+
+def decode(data: bytes, offset: int = 0):
+    try:
+        decode_fields = _decoders[data[offset]]
+    except (IndexError, KeyError):
+        raise ValueError(f'Unknown packet: {data!r}')
+
+    return decode_fields(data, offset + 1)
+
+
+# A batch is the tag followed by each of its objects encoded
+# and prefixed with their length as an unsigned short
+BATCH_TAG = 5
+MAX_PACKET_SIZE = 1400
+_length = struct.Struct('<H')
+
+
+def encode_batch(batch: BatchCommand) -> bytes:
+    return b''.join(_length.pack(len(data)) + data
+                    for data in map(encode, batch.commands))
+
+
+def decode_batch(data: bytes, offset: int) -> BatchCommand:
+    commands = []
+    while offset < len(data):
+        length, = _length.unpack_from(data, offset)
+        offset += _length.size
+        commands.append(decode(data[offset:offset + length]))
+        offset += length
+
+    return BatchCommand(tuple(commands))
+
+
+def batch_packets(objs) -> list[bytes]:
+    """
+    Returns the packets of BatchCommands with all the objects,
+    where each packet is at most MAX_PACKET_SIZE bytes so it fits
+    in a single datagram without being fragmented.
+    """
+    # The objects are packed into one buffer that already starts with
+    # the header and tag of a batch. Only a full packet is copied out.
+    header_size = len(PROTOCOL_HEADER) + 1
+    buffer = bytearray(MAX_PACKET_SIZE)
+    buffer[:header_size] = PROTOCOL_HEADER + bytes([BATCH_TAG])
+    packets = []
+    offset = header_size
+
+    for obj in objs:
+        packer = _batch_packers.get(type(obj))
+        if packer is not None:
+            entry, tag, fields = packer
+            size = entry.size
+        else:
+            data = encode(obj)
+            size = _length.size + len(data)
+
+        if offset + size > MAX_PACKET_SIZE and offset > header_size:
+            packets.append(bytes(buffer[:offset]))
+            offset = header_size
+
+        if offset + size > MAX_PACKET_SIZE:
+            # An object too big for a packet gets one of its own
+            buffer.extend(bytes(offset + size - len(buffer)))
+
+        if packer is not None:
+            entry.pack_into(buffer, offset, size - _length.size,
+                            tag, *fields(obj))
+        else:
+            _length.pack_into(buffer, offset, len(data))
+            buffer[offset + _length.size:offset + size] = data
+
+        offset += size
+
+    if offset > header_size:
+        packets.append(bytes(buffer[:offset]))
+
+    return packets
+
+
+def quantize(vector: tuple[float, float], scale: float) -> tuple[int, int]:
+    # Rounds to the nearest step and clamps to what fits in 16 bits
+    x, y = vector
+    return (max(-32768, min(32767, round(x * scale))),
+            max(-32768, min(32767, round(y * scale))))
+
+
+def most_recent(cls, count: int, *fields):
+    # The count of an OnlyMostRecentCommand is the one given by
+    # the server and not the one it gets when it is created here.
+    command = cls(*fields)
+    object.__setattr__(command, '_count', count)
+    return command
+
+
+register_struct(
+    SetRadiusCommand, 1, 'Qd',
+    lambda command: (command._count, command.radius),
+    lambda count, radius: most_recent(SetRadiusCommand, count, radius))
+
+register_struct(
+    SetIdCommand, 2, 'I',
+    lambda command: (command.id_,),
+    lambda id_: SetIdCommand(Id(id_)))
+
+register_struct(
+    RemovePlayerCommand, 3, 'I',
+    lambda command: (command.id_,),
+    lambda id_: RemovePlayerCommand(Id(id_)))
+
+register_struct(
+    SetPositionCommand, 4, 'QI6h',
+    lambda command: (command._count, command.id_,
+                     *quantize(command.position, POSITION_SCALE),
+                     *quantize(command.last_acceleration, ACCELERATION_SCALE),
+                     *quantize(command.velocity, VELOCITY_SCALE)),
+    lambda count, id_, px, py, ax, ay, vx, vy: most_recent(
+        SetPositionCommand, count, Id(id_),
+        (px / POSITION_SCALE, py / POSITION_SCALE),
+        (ax / ACCELERATION_SCALE, ay / ACCELERATION_SCALE),
+        (vx / VELOCITY_SCALE, vy / VELOCITY_SCALE)))
+
+register_struct(
+    KeyUpInput, KEY_UP_TAG, 'i',
+    lambda input_: (input_.key,),
+    KeyUpInput)
+
+register_struct(
+    KeyDownInput, KEY_DOWN_TAG, 'i',
+    lambda input_: (input_.key,),
+    KeyDownInput)
+
+register_struct(
+    Ping, PING_TAG, '',
+    lambda ping: (),
+    Ping)
+
+register(BatchCommand, BATCH_TAG, encode_batch, decode_batch)
+
+# Every ping is the same packet
+PING_PACKET = packet(Ping())
+
+# The packets of the inputs that have been sent, see Client.send.
+# Inputs are frozen so equal inputs are the same packet.
+_input_packets = {}
+
+# An acknowledge is sent with the object it acknowledges
+ACKNOWLEDGE_TAG = 20
+
+register(
+    Acknowledge, ACKNOWLEDGE_TAG,
+    lambda acknowledge: encode(acknowledge.obj),
+    lambda data, offset: Acknowledge(decode(data, offset)))
@@ -1,125 +1,146 @@
-from dataclasses import dataclass, field
+from __future__ import annotations
 
 import pygame
-from pygame import Vector2, Rect
+from pygame import Vector2
 
 import getpass
+from typing import TYPE_CHECKING
 
+import ui
 from id import Id
+from rectf import Rectf
 
+if TYPE_CHECKING:
+    from scope import Scope
 
-@dataclass
+
+# The normalized direction of every combination of the up, left,
+# down and right bits of a mask. Opposite directions cancel out.
+def _direction(mask: int) -> tuple[float, float]:
+    direction = Vector2(0, 0)
+    if mask & 8:
+        direction -= Vector2(0, 1)
+    if mask & 4:
+        direction -= Vector2(1, 0)
+    if mask & 2:
+        direction += Vector2(0, 1)
+    if mask & 1:
+        direction += Vector2(1, 0)
+
+    if direction.length() != 0:
+        direction.normalize_ip()
+
+    return direction.x, direction.y
+
+
+_DIRECTIONS = tuple(_direction(mask) for mask in range(16))
+
+
+def input_direction(pressed_keys) -> tuple[float, float]:
+    up = pygame.K_w in pressed_keys or pygame.K_UP in pressed_keys
+    left = pygame.K_a in pressed_keys or pygame.K_LEFT in pressed_keys
+    down = pygame.K_s in pressed_keys or pygame.K_DOWN in pressed_keys
+    right = pygame.K_d in pressed_keys or pygame.K_RIGHT in pressed_keys
+    return _DIRECTIONS[up << 3 | left << 2 | down << 1 | right]
+
+
+# A player is a view into the struct of arrays in its scope.
+# The state of the player is stored in the scope so the physics
+# can be done for all players at once, see Scope.step.
 class Player:
-    id: Id
-    name: str = getpass.getuser()
-
-    force: Vector2 = field(default_factory = Vector2)
-    acceleration: Vector2 = field(default_factory = Vector2)
-    velocity: Vector2 = field(default_factory = Vector2)
-    position: Vector2 = field(default_factory = Vector2)
-    input_force: float = 325
-    
-    radius: float = 0.5
-    mass: float = 50
-    drag: float = 4
-    brake: float = 25
-    incosistent_surface: float = 0.002
-
-    braking: bool = False
-
-    def __post_init__(self):
+    __slots__ = ('id', 'scope', 'name', 'debug', 'last_acceleration')
+
+    input_force = 325
+
+    radius = 0.5
+    mass = 50
+    drag = 4
+    brake = 25
+    incosistent_surface = 0.002
+
+    def __init__(self, id: Id, scope: Scope, name: str = getpass.getuser()):
+        self.id = id
+        self.scope = scope
+        self.name = name
+
         self.debug = False
-        self.font = pygame.font.SysFont('MS UI Gothic', 20)
         self.last_acceleration = Vector2(0, 0)
 
-    def update(self, pressed_keys, deltatime):
-        self.input(pressed_keys)
-        self.physics(deltatime)
-
-    def input_vector(self, pressed_keys):
-        direction = Vector2(0, 0)
-        if pygame.K_w in pressed_keys or pygame.K_UP in pressed_keys:
-            direction -= Vector2(0, 1)
-        if pygame.K_a in pressed_keys or pygame.K_LEFT in pressed_keys:
-            direction -= Vector2(1, 0)
-        if pygame.K_s in pressed_keys or pygame.K_DOWN in pressed_keys:
-            direction += Vector2(0, 1)
-        if pygame.K_d in pressed_keys or pygame.K_RIGHT in pressed_keys:
-            direction += Vector2(1, 0)
-
-        if direction.length() != 0:
-            return direction.normalize()
-        else:
-            return Vector2(0, 0)
+    def __repr__(self):
+        return f'Player(id={self.id!r}, name={self.name!r})'
+
+    # The font is only loaded when a player is drawn, so the players
+    # of a server don't need pygame.font to be initialized
+    @property
+    def font(self) -> pygame.font.Font:
+        return ui.sys_font('MS UI Gothic', 20)
+
+    @property
+    def row(self) -> int:
+        return self.scope.rows[self.id]
+
+    @property
+    def position(self) -> Vector2:
+        return Vector2(*self.scope.positions[self.row])
+
+    @position.setter
+    def position(self, position: Vector2):
+        self.scope.positions[self.row] = position
+
+    @property
+    def velocity(self) -> Vector2:
+        return Vector2(*self.scope.velocities[self.row])
+
+    @velocity.setter
+    def velocity(self, velocity: Vector2):
+        self.scope.velocities[self.row] = velocity
+
+    @property
+    def force(self) -> Vector2:
+        return Vector2(*self.scope.forces[self.row])
+
+    @force.setter
+    def force(self, force: Vector2):
+        self.scope.forces[self.row] = force
+
+    @property
+    def braking(self) -> bool:
+        return bool(self.scope.braking[self.row])
+
+    @braking.setter
+    def braking(self, braking: bool):
+        self.scope.braking[self.row] = braking
 
     def input(self, keys):
-        self.force += self.input_vector(keys) * self.input_force
-        self.braking = pygame.K_SPACE in keys
-
-    def physics(self, deltatime):
-        # Drag
-        drag_force = self.velocity.length() ** 2 * self.drag
-        if self.velocity.length() != 0:
-            self.force -= self.velocity.normalize() * drag_force
-
-        # Brake
-        brake_force = self.velocity.length() ** 2 * self.brake
-        if self.braking and self.velocity.length() != 0:
-            self.force -= self.velocity.normalize() * brake_force
-
-        # Not 'real' physics, but does simulate an inconsistent surface (both on the floor and the ball)
-        if self.incosistent_surface > 0:
-            if self.velocity.length() > self.incosistent_surface:
-                self.velocity -= self.velocity.normalize() * self.incosistent_surface
-            else:
-                self.velocity -= self.velocity
-
-        # Acceleration, velocity and position
-        self.acceleration = self.force / self.mass
-        self.velocity += self.acceleration * deltatime
-        self.position += self.velocity * deltatime
-
-        # Reset force
-        self.force = Vector2(0, 0)
-
-    def collision(self, others):
-        for other in others:
-            if self.id > other.id and Vector2.distance_to(self.position, other.position) < self.radius + other.radius:
-                m = self.mass
-                M = other.mass
-                u = self.velocity
-                U = other.velocity
-
-                self.velocity =  (2 * M * U - M * u + m * u) / (M + m)
-                other.velocity = (M * U - U * m + 2 * m * u) / (M + m)
+        dx, dy = input_direction(keys)
+        row = self.row
+        forces = self.scope.forces
+        forces[row, 0] += dx * self.input_force
+        forces[row, 1] += dy * self.input_force
+        self.scope.braking[row] = pygame.K_SPACE in keys
 
     @property
-    def bounding_box(self):
+    def bounding_box(self) -> Rectf:
         bottom_left = self.position - Vector2(self.radius)
-        return Rect(bottom_left, Vector2(2 * self.radius))
+        return Rectf(bottom_left, Vector2(2 * self.radius))
 
-    def draw(self, scene):
-        pixelPosition = scene.camera.world_to_pixel(self.position)
+    def draw(self, scene, pixelPosition: tuple[float, float]):
         pixelRadius = self.radius * scene.camera.world_to_pixel_ratio
 
         pygame.draw.circle(scene.screen, (255, 0, 0),
                            pixelPosition,
                            pixelRadius)
-        labelPosition = Vector2(pixelPosition.x, pixelPosition.y + pixelRadius * 1.4)
-        text = self.font.render(
-            self.name,
-            True,
-            (0, 0, 0)
-        )
-        text_rect = text.get_rect(center=(labelPosition.x, labelPosition.y))
+        labelPosition = (pixelPosition[0], pixelPosition[1] + pixelRadius * 1.4)
+        text = ui.render_text(self.font, self.name, True, (0, 0, 0))
+        text_rect = text.get_rect(center=labelPosition)
         scene.screen.blit(text, text_rect)
 
         if self.debug:
-            scene.screen.blit(self.font.render(
-                f"Position: {self.position}", False, (0, 0, 0)), (10, 0))
-            scene.screen.blit(self.font.render(
-                f"Velocity: {self.velocity}", False, (0, 0, 0)), (10, 20))
-            scene.screen.blit(self.font.render(
-                f"Acceleration: {self.last_acceleration}", False, (0, 0, 0)), (10, 40))
-            scene.screen.blit(self.font.render(
-                f"World position: {scene.camera.world_to_pixel(self.position)}", False, (0, 0, 0)), (10, 60))
+            scene.screen.blit(ui.render_text(
+                self.font, f"Position: {self.position}", False, (0, 0, 0)), (10, 0))
+            scene.screen.blit(ui.render_text(
+                self.font, f"Velocity: {self.velocity}", False, (0, 0, 0)), (10, 20))
+            scene.screen.blit(ui.render_text(
+                self.font, f"Acceleration: {self.last_acceleration}", False, (0, 0, 0)), (10, 40))
+            scene.screen.blit(ui.render_text(
+                self.font, f"World position: {scene.camera.world_to_pixel(self.position)}", False, (0, 0, 0)), (10, 60))
@@ -1,42 +1,43 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
 from pygame import Vector2
 
 
-@dataclass
 class Rectf:
-    bottom_left: Vector2
-    size: Vector2
+    # The edges are stored directly instead of being computed from
+    # bottom_left and size on every access. Move the rect with move
+    # so they stay in sync.
+    __slots__ = ('left', 'bottom', 'width', 'height', 'right', 'top')
+
+    def __init__(self, bottom_left: Vector2, size: Vector2):
+        self.left = bottom_left.x
+        self.bottom = bottom_left.y
+        self.width = size.x
+        self.height = size.y
+        self.right = self.left + self.width
+        self.top = self.bottom + self.height
+
+    def __repr__(self):
+        return f'Rectf(bottom_left={self.bottom_left}, size={self.size})'
 
     @property
-    def top_right(self):
-        return Vector2(self.bottom_left.x + self.width, self.bottom_left.y + self.height)
-
-    @property
-    def left(self):
-        return self.bottom_left.x
-
-    @property
-    def right(self):
-        return self.top_right.x
+    def bottom_left(self):
+        return Vector2(self.left, self.bottom)
 
     @property
-    def bottom(self):
-        return self.bottom_left.y
+    def size(self):
+        return Vector2(self.width, self.height)
 
     @property
-    def top(self):
-        return self.top_right.y
-
-    @property
-    def width(self):
-        return self.size.x
+    def top_right(self):
+        return Vector2(self.right, self.top)
 
-    @property
-    def height(self):
-        return self.size.y
+    def move(self, dx: float, dy: float):
+        self.left += dx
+        self.right += dx
+        self.bottom += dy
+        self.top += dy
 
     def contains(self, other: Rectf):
-        return other.right < self.right and other.left > self.left \
-            and other.top > self.top and other.bottom < self.bottom
+        return self.left <= other.left and self.right >= other.right \
+            and self.bottom <= other.bottom and self.top >= other.top
@@ -1,12 +1,257 @@
+import math
 from dataclasses import dataclass, field
 from typing import Optional
 
+import numpy as np
+
+try:
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
+
 from id import Id
 from player import Player
 
 
+def empty_vectors() -> np.ndarray:
+    return np.zeros((0, 2))
+
+
 @dataclass
 class Scope:
     id_: Optional[Id] = None
     circle_radius: float = 20
     players: dict[Id, Player] = field(default_factory=dict)
+
+    # The state of the players is stored as a struct of arrays so
+    # the physics can be done for every player at once with numpy.
+    # Row i in every array belongs to the i'th player in players
+    # and rows maps the id of a player to its row.
+    rows: dict[Id, int] = field(default_factory=dict)
+    positions: np.ndarray = field(default_factory=empty_vectors)
+    velocities: np.ndarray = field(default_factory=empty_vectors)
+    forces: np.ndarray = field(default_factory=empty_vectors)
+    braking: np.ndarray = field(default_factory=lambda: np.zeros(0, bool))
+
+    def add_player(self, id_: Id) -> Player:
+        n = len(self.players) + 1
+        self.rows[id_] = n - 1
+        self.positions = resize_rows(self.positions, n)
+        self.velocities = resize_rows(self.velocities, n)
+        self.forces = resize_rows(self.forces, n)
+        self.braking = resize_rows(self.braking, n)
+
+        player = self.players[id_] = Player(id_, self)
+        return player
+
+    def remove_player(self, id_: Id):
+        # The server resends a removal until it is acknowledged, so
+        # the same player can be removed more than once
+        if id_ not in self.players:
+            return
+
+        row = self.rows[id_]
+        del self.players[id_]
+
+        # Deleting a row moves every row after it one up
+        n = len(self.players)
+        for array in (self.positions, self.velocities,
+                      self.forces, self.braking):
+            array[row:n] = array[row + 1:]
+
+        self.positions = resize_rows(self.positions, n)
+        self.velocities = resize_rows(self.velocities, n)
+        self.forces = resize_rows(self.forces, n)
+        self.braking = resize_rows(self.braking, n)
+
+        self.rows = {id_: row for row, id_ in enumerate(self.players)}
+
+    def set_positions(self, ids: list[Id], positions, velocities):
+        rows = [self.rows[id_] for id_ in ids]
+        self.positions[rows] = positions
+        self.velocities[rows] = velocities
+
+    def extrapolate(self, deltatime: float):
+        # Moves every player by its velocity, which is where the
+        # server will have moved it if it isn't slowed or pushed
+        self.positions += self.velocities * deltatime
+
+    def step(self, deltatime: float):
+        step_players(self.positions, self.velocities, self.forces,
+                     self.braking, Player.drag, Player.brake,
+                     Player.incosistent_surface, Player.mass, deltatime)
+
+    def collide(self):
+        # Every player, in order, collides with the players with a
+        # lower id that it touches, one pair at a time. Only the players in the same or neighbouring cells of a grid
+        # can touch, so only those pairs are checked. The cells are as
+        # big as the distance at which two players touch.
+        if len(self.players) < 2:
+            return
+
+        ids = list(self.players)
+        cells = np.floor(self.positions / (2 * Player.radius)) \
+            .astype(np.int64).tolist()
+
+        grid = {}
+        for row, (x, y) in enumerate(cells):
+            grid.setdefault((x, y), []).append(row)
+
+        # A player only collides with the players with a lower id
+        pairs = []
+        for (x, y), rows in grid.items():
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    others = grid.get((x + dx, y + dy))
+                    if others is None:
+                        continue
+
+                    for i in rows:
+                        for j in others:
+                            if ids[i] > ids[j]:
+                                pairs.append((i, j))
+
+        if not pairs:
+            return
+
+        # The pairs are collided in the order of the players
+        pairs.sort()
+        collide_players(self.positions, self.velocities,
+                        np.array(pairs, np.int64),
+                        Player.radius, Player.mass)
+
+
+def resize_rows(array: np.ndarray, n: int) -> np.ndarray:
+    """
+    Returns the first n rows of the buffer the array is a view into.
+    The rows added are zeros. When the buffer is too small it is
+    replaced with one twice as big, so adding a player doesn't
+    copy every array each time.
+    """
+    buffer = array if array.base is None else array.base
+    if buffer.shape[0] < n:
+        grown = np.zeros((max(n, 2 * buffer.shape[0]),) + array.shape[1:],
+                         array.dtype)
+        grown[:len(array)] = array
+        buffer = grown
+    elif n > len(array):
+        buffer[len(array):n] = 0
+
+    return buffer[:n]
+
+
+def step_players_numpy(
+        positions, velocities, forces, braking,
+        drag, brake, incosistent_surface, mass, deltatime):
+    # The direction every player is moving in. It is zero
+    # for the players standing still so they aren't affected.
+    speeds = np.hypot(velocities[:, 0], velocities[:, 1])
+    directions = np.divide(velocities, speeds[:, np.newaxis],
+                           out=np.zeros_like(velocities),
+                           where=speeds[:, np.newaxis] != 0)
+
+    # Drag and brake
+    resistance = drag + brake * braking
+    forces -= directions * (speeds ** 2 * resistance)[:, np.newaxis]
+
+    # Not 'real' physics, but does simulate an inconsistent surface (both on the floor and the ball)
+    if incosistent_surface > 0:
+        directions *= incosistent_surface
+        velocities -= directions
+        velocities[speeds <= incosistent_surface] = 0
+
+    # Acceleration, velocity and position. The forces are reset
+    # afterwards anyway, so that array is reused for the changes
+    # in velocity and position instead of making new arrays.
+    forces *= deltatime / mass
+    velocities += forces
+    np.multiply(velocities, deltatime, out=forces)
+    positions += forces
+
+    # Reset force
+    forces[:] = 0
+
+
+# The same as step_players_numpy but written as one loop over the
+# players, so numba can compile it without any temporary arrays.
+def step_players_loop(
+        positions, velocities, forces, braking,
+        drag, brake, incosistent_surface, mass, deltatime):
+    # These are the same for every player so only compute them once
+    braking_resistance = drag + brake
+    impulse = deltatime / mass
+
+    for i in prange(positions.shape[0]):
+        vx = velocities[i, 0]
+        vy = velocities[i, 1]
+        fx = forces[i, 0]
+        fy = forces[i, 1]
+        speed = math.sqrt(vx * vx + vy * vy)
+
+        if speed != 0:
+            # Drag and brake. The force is speed ** 2 * resistance
+            # along the direction (vx, vy) / speed.
+            resistance = braking_resistance if braking[i] else drag
+            fx -= vx * speed * resistance
+            fy -= vy * speed * resistance
+
+        # Inconsistent surface
+        if incosistent_surface > 0:
+            if speed > incosistent_surface:
+                vx -= vx / speed * incosistent_surface
+                vy -= vy / speed * incosistent_surface
+            else:
+                vx = 0.0
+                vy = 0.0
+
+        # Acceleration, velocity and position
+        vx += fx * impulse
+        vy += fy * impulse
+        velocities[i, 0] = vx
+        velocities[i, 1] = vy
+        positions[i, 0] += vx * deltatime
+        positions[i, 1] += vy * deltatime
+
+        # Reset force
+        forces[i, 0] = 0.0
+        forces[i, 1] = 0.0
+
+
+# The elastic collisions of the players in Scope.collide. pairs are
+# the rows (i, j) of the players that might touch and the velocities
+# are changed one pair at a time.
+def collide_players(positions, velocities, pairs, radius, mass):
+    min_distance_squared = (radius + radius) ** 2
+
+    for k in range(pairs.shape[0]):
+        i = pairs[k, 0]
+        j = pairs[k, 1]
+
+        dx = positions[i, 0] - positions[j, 0]
+        dy = positions[i, 1] - positions[j, 1]
+        if dx * dx + dy * dy >= min_distance_squared:
+            continue
+
+        # Every player has the same mass, but the formula is
+        # kept general
+        m = M = mass
+        ux = velocities[i, 0]
+        uy = velocities[i, 1]
+        Ux = velocities[j, 0]
+        Uy = velocities[j, 1]
+
+        velocities[i, 0] = (2 * M * Ux - M * ux + m * ux) / (M + m)
+        velocities[i, 1] = (2 * M * Uy - M * uy + m * uy) / (M + m)
+        velocities[j, 0] = (M * Ux - Ux * m + 2 * m * ux) / (M + m)
+        velocities[j, 1] = (M * Uy - Uy * m + 2 * m * uy) / (M + m)
+
+
+# Numba is optional. Without it the numpy version is used.
+if numba:
+    step_players = numba.njit(step_players_loop, fastmath=True,
+                              parallel=True, cache=True)
+    collide_players = numba.njit(collide_players, fastmath=True, cache=True)
+else:
+    step_players = step_players_numpy
@@ -0,0 +1,119 @@
+import network
+from id import Id
+from scope import Scope
+
+
+def test_set_position_batch_keeps_last_command_of_player():
+    scope = Scope()
+    commands = [
+        network.SetPositionCommand(Id(1), (1.0, 1.0), (0.0, 0.0), (0.0, 0.0)),
+        network.SetPositionCommand(Id(2), (5.0, 5.0), (0.0, 0.0), (0.0, 0.0)),
+        network.SetPositionCommand(Id(1), (2.0, 2.0), (0.0, 0.0), (3.0, 3.0)),
+    ]
+
+    network.SetPositionCommand.run_batch(scope, commands)
+
+    assert scope.positions[scope.rows[Id(1)]].tolist() == [2.0, 2.0]
+    assert scope.velocities[scope.rows[Id(1)]].tolist() == [3.0, 3.0]
+    assert scope.positions[scope.rows[Id(2)]].tolist() == [5.0, 5.0]
+
+
+def decode_packet(data):
+    assert data[:len(network.PROTOCOL_HEADER)] == network.PROTOCOL_HEADER
+    return network.decode(data, len(network.PROTOCOL_HEADER))
+
+
+def round_trip(obj):
+    return decode_packet(network.packet(obj))
+
+
+def test_every_registered_type_round_trips():
+    objs = [
+        network.SetRadiusCommand(12.5),
+        network.SetIdCommand(Id(3)),
+        network.RemovePlayerCommand(Id(4)),
+        network.SetPositionCommand(
+            Id(5), (1.25, -2.5), (0.125, -0.25), (3.5, -4.75)),
+        network.KeyUpInput(97),
+        network.KeyDownInput(-1),
+        network.Ping(),
+        network.BatchCommand((network.SetRadiusCommand(1.0),
+                              network.RemovePlayerCommand(Id(2)))),
+        network.Acknowledge(network.SetIdCommand(Id(6))),
+    ]
+    # Every registered type is covered
+    assert {type(obj) for obj in objs} == set(network._encoders)
+
+    for obj in objs:
+        decoded = round_trip(obj)
+        assert type(decoded) is type(obj)
+        assert decoded == obj
+        if isinstance(obj, network.OnlyMostRecentCommand):
+            assert decoded._count == obj._count
+
+
+def test_tags_are_unique():
+    tags = [tag for tag, _, _ in network._encoders.values()]
+    assert len(tags) == len(set(tags))
+    assert set(tags) == {bytes([tag]) for tag in network._decoders}
+
+
+def test_batch_packets_split_into_datagrams():
+    commands = [network.SetPositionCommand(Id(i), (i / 100, 0.0),
+                                           (0.0, 0.0), (0.0, -i / 100))
+                for i in range(200)]
+    commands.append(network.SetRadiusCommand(7.0))
+
+    packets = network.batch_packets(commands)
+
+    assert len(packets) > 1
+    assert all(len(data) <= network.MAX_PACKET_SIZE for data in packets)
+
+    decoded = []
+    for data in packets:
+        decoded.extend(decode_packet(data).commands)
+
+    assert decoded == commands
+    assert [command._count for command in decoded] \
+        == [command._count for command in commands]
+
+
+def test_positions_out_of_range_are_clamped():
+    command = network.SetPositionCommand(
+        Id(1), (400.0, -400.0), (40.0, -40.0), (1000.0, -1000.0))
+
+    decoded = round_trip(command)
+
+    assert decoded.position == (327.67, -327.68)
+    assert decoded.last_acceleration == (32.767, -32.768)
+    assert decoded.velocity == (327.67, -327.68)
+
+
+def test_positions_are_rounded_to_the_nearest_step():
+    command = network.SetPositionCommand(
+        Id(1), (1.234, -1.236), (0.0, 0.0), (0.005, -0.004))
+
+    decoded = round_trip(command)
+
+    assert decoded.position == (1.23, -1.24)
+    assert decoded.velocity == (0.0, 0.0)
+
+
+def test_client_acknowledgement_matches_packet():
+    server = network.socket.socket(network.socket.AF_INET,
+                                   network.socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', network.PORT))
+    server.settimeout(1)
+    client = network.Client('127.0.0.1')
+    try:
+        for command in (network.SetIdCommand(Id(9)),
+                        network.RemovePlayerCommand(Id(10))):
+            acknowledge = network.Acknowledge(command)
+            client.send(acknowledge)
+            data, _ = server.recvfrom(4096)
+
+            assert data == network.packet(acknowledge)
+            assert decode_packet(data) == acknowledge
+    finally:
+        client.close()
+        server.close()
@@ -0,0 +1,18 @@
+from id import Id
+from network import RemovePlayerCommand
+from scope import Scope
+
+
+def test_remove_player_twice():
+    scope = Scope()
+    for id_ in (Id(1), Id(2), Id(3)):
+        scope.add_player(id_)
+    scope.positions[:] = [[1, 1], [2, 2], [3, 3]]
+
+    command = RemovePlayerCommand(Id(2))
+    command.run(scope)
+    command.run(scope)
+
+    assert list(scope.players) == [Id(1), Id(3)]
+    assert scope.rows == {Id(1): 0, Id(3): 1}
+    assert scope.positions.tolist() == [[1, 1], [3, 3]]
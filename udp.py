@@ -0,0 +1,66 @@
+import socket
+
+RECEIVE_BATCH_SIZE = 64
+
+# Receiving doesn't wait for datagrams even on a blocking socket
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+def send_many(sock: socket.socket, packets: list[tuple[bytes, tuple[str, int]]]):
+    """
+    Sends every (data, address) pair in packets on sock.
+    """
+    # This is a plain loop of sendto. Calling sendmmsg through ctypes
+    # has to copy every packet into ctypes buffers first, which costs
+    # more than the system calls it saves.
+    sendto = sock.sendto
+    for data, address in packets:
+        sendto(data, address)
+
+
+class Receiver:
+    """
+    Receives the datagrams waiting on a socket in batches. The
+    datagrams are received into one buffer that is made once, and
+    the data that is returned are views into it. They are only valid
+    until receive is called again.
+    """
+
+    def __init__(self, sock: socket.socket, size: int = 4096):
+        self.sock = sock
+        self.size = size
+
+        self._buffer = bytearray(RECEIVE_BATCH_SIZE * size)
+        self._view = memoryview(self._buffer)
+
+    def receive(
+            self, limit: int = RECEIVE_BATCH_SIZE
+    ) -> list[tuple[memoryview, tuple[str, int]]]:
+        """
+        Returns up to limit (data, address) pairs, at most
+        RECEIVE_BATCH_SIZE. Fewer than the limit means there are
+        no more datagrams waiting.
+        """
+        # This is a loop of recvfrom_into. One recvmmsg through ctypes
+        # was slower, since every datagram then has to be read out of
+        # the ctypes structs in Python. The buffer only has room for
+        # RECEIVE_BATCH_SIZE datagrams.
+        limit = min(limit, RECEIVE_BATCH_SIZE)
+        recvfrom_into = self.sock.recvfrom_into
+        view = self._view
+        size = self.size
+
+        packets = []
+        while len(packets) < limit:
+            start = len(packets) * size
+            try:
+                received, address = recvfrom_into(
+                    view[start:start + size], size, MSG_DONTWAIT)
+            except (ConnectionResetError, ConnectionRefusedError):
+                continue
+            except BlockingIOError:
+                break
+
+            packets.append((view[start:start + received], address))
+
+        return packets
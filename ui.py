@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import abc
 import enum
+import functools
 import logging
 from dataclasses import dataclass
 from typing import Callable, Optional
@@ -10,6 +11,21 @@ import pygame
 from pygame import Color, Rect, Vector2
 
 
+# Looking up a system font and loading it is slow, so every
+# font is only loaded once and the Font object is shared.
+@functools.lru_cache
+def sys_font(name: str, size: int) -> pygame.font.Font:
+    return pygame.font.SysFont(name, size)
+
+
+# Rendering text rasterizes it every time, but the same text is
+# drawn every frame. The most recently used texts are kept.
+@functools.lru_cache(maxsize=256)
+def render_text(font: pygame.font.Font, text: str, antialias: bool,
+                color) -> pygame.Surface:
+    return font.render(text, antialias, color)
+
+
 # TODO: It might be cool to have a global style thing.
 # TODO: Add containers that layout widgets nicely
 # implementing a flexbox would be *chefs kiss*
@@ -25,7 +41,8 @@ class Widget(abc.ABC):
     """
 
     @abc.abstractmethod
-    def draw(self, screen: pygame.Surface):
+    # Returns the rect that was drawn on
+    def draw(self, screen: pygame.Surface) -> pygame.Rect:
         if self.pos is None:
             raise Exception('Widget cannot be drawn without a position')
 
@@ -107,7 +124,7 @@ class ConstrainedBox(Widget):
 
     def draw(self, screen: pygame.Surface):
         super().draw(screen)
-        self.child.draw(screen)
+        return self.child.draw(screen)
 
     def handle(self, event: pygame.event.Event):
         self.child.handle(event)
@@ -169,6 +186,8 @@ class Button(Widget):
         pygame.draw.rect(screen, self.border_color,
                          self.rect, width=self.border_width)
 
+        return self.rect
+
     def handle(self, event: pygame.event.Event):
         if event.type == pygame.MOUSEBUTTONUP:
             if self.mouse_over:
@@ -295,7 +314,7 @@ class Entry(Widget):
     def draw(self, screen: pygame.Surface):
         super().draw(screen)
 
-        self._text.draw(screen)
+        text_rect = self._text.draw(screen)
 
         if self.focused:
             self._draw_cursor(screen)
@@ -303,6 +322,8 @@ class Entry(Widget):
         else:
             pygame.draw.rect(screen, Color('black'), self.rect, width=4)
 
+        return self.rect.union(text_rect)
+
     def _draw_cursor(self, screen):
         cursor_pos = self.cursor.window_pos
         pygame.draw.line(screen, Color('red'),
@@ -410,7 +431,7 @@ class Text(Widget):
     def draw(self, screen: pygame.Surface):
         super().draw(screen)
 
-        self._text.draw(screen)
+        return self._text.draw(screen)
 
     @property
     def pos(self) -> Vector2:
@@ -463,6 +484,9 @@ class TextRenderer:
         # are used to render text have changed. It is
         # cleared the next time the text is rendered
         # which is probably when it is draw to the screen.
+        # Setting a property to the value it already has
+        # doesn't make it dirty, so the rendered lines are
+        # reused until the text actually changes.
         self._dirty = True
 
         self._render()
@@ -471,9 +495,13 @@ class TextRenderer:
         if self._dirty:
             self._render()
 
+        rects = []
         for i, line in enumerate(self._rendered_lines):
             pos = self.pos + Vector2(0, i * self.linesize)
-            surface.blit(line, pos)
+            rects.append(surface.blit(line, pos))
+
+        # The rect covering every line
+        return rects[0].unionall(rects[1:])
 
     @property
     def height(self):
@@ -502,8 +530,9 @@ class TextRenderer:
 
     @text.setter
     def text(self, text):
-        self._text = text
-        self._dirty = True
+        if text != self._text:
+            self._text = text
+            self._dirty = True
 
     @property
     def font(self):
@@ -511,8 +540,9 @@ class TextRenderer:
 
     @font.setter
     def font(self, font):
-        self._font = font
-        self._dirty = True
+        if font != self._font:
+            self._font = font
+            self._dirty = True
 
     @property
     def color(self):
@@ -520,8 +550,9 @@ class TextRenderer:
 
     @color.setter
     def color(self, color):
-        self._color = color
-        self._dirty = True
+        if color != self._color:
+            self._color = color
+            self._dirty = True
 
     @property
     def max_width(self):
@@ -529,8 +560,9 @@ class TextRenderer:
 
     @max_width.setter
     def max_width(self, max_width):
-        self._max_width = max_width
-        self._dirty = True
+        if max_width != self._max_width:
+            self._max_width = max_width
+            self._dirty = True
 
     def _render(self):
         logging.debug('TextUI rendering text')